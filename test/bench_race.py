@@ -0,0 +1,157 @@
+# Copyright (C) 2011 John Feuerstein <john@feurix.com>
+#
+# This file is part of the speedpad project.
+#
+# speedpad is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# speedpad is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Measure the load of a race server hosting many races
+
+Simulates --races rooms of --players players each, all typing and sending
+progress at the highest rate of the client (every 0.1 seconds), for one
+second of races.  Messages are fed to the server's connections and the
+standings are written to in-memory transports, so only the server's own
+work (parsing, coalescing, encoding and fan-out) is measured, not the
+kernel's.  The result is the share of one core needed to keep up, which
+is compared against the stored baseline in bench_baseline.json like
+bench_speedpad.py does.
+
+    python bench_race.py [--races N] [--players N] [--save]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+BASELINE = os.path.join(os.path.dirname(__file__) or '.',
+                        'bench_baseline.json')
+
+
+def load_source(name, pathname):
+    try:
+        from importlib.machinery import SourceFileLoader
+        from importlib.util import module_from_spec, spec_from_loader
+    except ImportError:
+        import imp
+        return imp.load_source(name, pathname)
+    loader = SourceFileLoader(name, pathname)
+    module = module_from_spec(spec_from_loader(name, loader))
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+load_source('speedpad', os.path.join(os.path.dirname(__file__) or '.',
+                                     '..', 'bin', 'speedpad'))
+import speedpad
+
+
+class Transport(object):
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def close(self):
+        raise RuntimeError("connection closed by server")
+
+
+def race(races, players, seconds=1, updates=10):
+    """Return CPU seconds per second of races and bytes sent per player"""
+    server = speedpad.RaceServer(lambda: iter(lambda: "quote", None))
+    conns = []
+    for room in xrange(races):
+        for player in xrange(players):
+            conn = speedpad.RaceConnection(server)
+            conn.connection_made(Transport())
+            conn.data_received(speedpad.encode_message(
+                    {'join': 'room%d' % room, 'name': 'player%d' % player}))
+            conn.data_received(b'{"next":true}\n')
+            conns.append(conn)
+    ticks = int(seconds / server.tick)
+    steps = seconds * updates
+    # the same messages as sent by clients typing at 6 chars per second
+    messages = [speedpad.encode_message({'pos': 6 * step // updates,
+                                         'speed': 6.0})
+                for step in xrange(steps)]
+    for conn in conns:
+        conn.transport.written = 0
+    started = clock()
+    for step in xrange(steps):
+        data = messages[step]
+        for conn in conns:
+            conn.data_received(data)
+        if step % (steps // ticks) == 0:
+            server.broadcast()
+    elapsed = clock() - started
+    sent = sum(conn.transport.written for conn in conns) / len(conns)
+    return elapsed / seconds, sent / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="benchmark the race server")
+    parser.add_argument('--races', type=int, default=300,
+                        help="concurrent races")
+    parser.add_argument('--players', type=int, default=4,
+                        help="players per race")
+    parser.add_argument('--save', action='store_true',
+                        help="store results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE)
+    args = parser.parse_args()
+
+    load, sent = min(race(args.races, args.players) for n in xrange(5))
+    name = 'race/%dx%d' % (args.races, args.players)
+    print("%-20s %6.1f%% of a core, %d bytes/s to each player" % (
+          name, load * 100, sent))
+    results = {name: load}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            fh.write('\n')
+        return 0
+    regressions = 0
+    for name, load in sorted(results.items()):
+        if name in baseline and load > baseline[name] * (1 + args.tolerance):
+            print("REGRESSION %s: %.1f%% vs. baseline %.1f%% of a core" % (
+                  name, load * 100, baseline[name] * 100))
+            regressions += 1
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et sw=4 sts=4 ts=4 tw=78 fen fdm=indent fdn=2 fdl=0
@@ -0,0 +1,164 @@
+# Copyright (C) 2011 John Feuerstein <john@feurix.com>
+#
+# This file is part of the speedpad project.
+#
+# speedpad is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# speedpad is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Measure weak-spot quote selection over a large corpus
+
+Writes a corpus of --quotes synthetic fortunes (random words from a fixed
+seed) to a temporary file and picks quotes from it with a QuoteSelector,
+weighted by the weak spots of a simulated player who misses a few chars.
+Reports the time to fill the pool for the first pick and the median time
+of the following picks, including reading and indexing the replacement
+candidate, which are compared against the stored baselines in
+bench_baseline.json like bench_speedpad.py does.
+
+    python bench_select.py [--quotes N] [--save]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+BASELINE = os.path.join(os.path.dirname(__file__) or '.',
+                        'bench_baseline.json')
+
+
+def load_source(name, pathname):
+    try:
+        from importlib.machinery import SourceFileLoader
+        from importlib.util import module_from_spec, spec_from_loader
+    except ImportError:
+        import imp
+        return imp.load_source(name, pathname)
+    loader = SourceFileLoader(name, pathname)
+    module = module_from_spec(spec_from_loader(name, loader))
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+load_source('speedpad', os.path.join(os.path.dirname(__file__) or '.',
+                                     '..', 'bin', 'speedpad'))
+import speedpad
+
+
+def fortunes(rng, count):
+    words = [''.join(rng.choice('etaoinshrdlucmfwypvbgkjqxz')
+                     for n in xrange(rng.randint(2, 9)))
+             for n in xrange(2000)]
+    for n in xrange(count):
+        yield ' '.join(rng.choice(words) for n in xrange(rng.randint(5, 40)))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def select(filename, picks, rng):
+    """Return seconds of the first pick and the median of the others"""
+    corpus = speedpad.Corpus(filename)
+    weakspots = speedpad.WeakSpots()
+    for char in 'qxzj':
+        weakspots.seen[char] = 20
+        weakspots.missed[char] = 5
+    for bigram in ('th', 'qu', 'ck'):
+        weakspots.seen[bigram] = 20
+        weakspots.missed[bigram] = 3
+    selector = speedpad.QuoteSelector(
+            len(corpus), corpus.read,
+            lambda raw: raw.decode('utf-8', 'replace'), rng=rng)
+    try:
+        started = clock()
+        selector.pick(weakspots.weights())
+        first = clock() - started
+        times = []
+        for n in xrange(picks):
+            started = clock()
+            selector.pick(weakspots.weights())
+            times.append(clock() - started)
+    finally:
+        corpus.close()
+    return first, median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="benchmark weak-spot quote selection")
+    parser.add_argument('--quotes', type=int, default=100000,
+                        help="fortunes in the corpus")
+    parser.add_argument('--picks', type=int, default=1000,
+                        help="quotes to pick after the first")
+    parser.add_argument('--save', action='store_true',
+                        help="store results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'fortunes')
+        with open(filename, 'wb') as fh:
+            for fortune in fortunes(rng, args.quotes):
+                fh.write(fortune.encode('ascii') + b'\n%\n')
+        first, pick = select(filename, args.picks, rng)
+    finally:
+        shutil.rmtree(tmpdir)
+    results = {'select/first': first, 'select/pick': pick}
+    for name, seconds in sorted(results.items()):
+        print("%-20s %8.3f ms" % (name, seconds * 1e3))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            fh.write('\n')
+        return 0
+    regressions = 0
+    for name, seconds in sorted(results.items()):
+        limit = baseline.get(name)
+        if limit is not None and seconds > limit * (1 + args.tolerance):
+            print("REGRESSION %s: %.3f ms vs. baseline %.3f ms" % (
+                  name, seconds * 1e3, baseline[name] * 1e3))
+            regressions += 1
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et sw=4 sts=4 ts=4 tw=78 fen fdm=indent fdn=2 fdl=0
@@ -0,0 +1,449 @@
+# Copyright (C) 2011 John Feuerstein <john@feurix.com>
+#
+# This file is part of the speedpad project.
+#
+# speedpad is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# speedpad is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Replay keystroke streams through the input path and measure it
+
+Streams are either synthetic (generated from a fixed seed by a simulated
+typist, so every run replays the same keys) or recorded with --dump and
+replayed with --replay. Each stream is fed through a headless
+TypingSession, or with --curses through SpeedPad.process using pads that
+are never flushed to the terminal.
+
+The hot paths include the once per round update and schedule of the
+adaptive robot's PaceModel, reported relative to the round they follow,
+and wrapping the quote again on a resize.
+
+Results are compared against the stored baselines in bench_baseline.json,
+a scenario more than --tolerance slower than its baseline fails the run.
+Baselines depend on the machine, refresh them with --save after changing
+hardware or interpreter.
+
+    python bench_speedpad.py [--curses] [--save] [--replay FILE ...]
+"""
+
+import argparse
+import collections
+import curses
+import curses.ascii
+import gc
+import json
+import os
+import random
+import sys
+import time
+
+
+def load_source(name, pathname):
+    try:
+        from importlib.machinery import SourceFileLoader
+        from importlib.util import module_from_spec, spec_from_loader
+    except ImportError:
+        import imp
+        return imp.load_source(name, pathname)
+    loader = SourceFileLoader(name, pathname)
+    module = module_from_spec(spec_from_loader(name, loader))
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+load_source('speedpad', os.path.join(os.path.dirname(__file__) or '.',
+                                     '..', 'bin', 'speedpad'))
+import speedpad
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = speedpad.monotonic
+
+BASELINE = os.path.join(os.path.dirname(__file__) or '.',
+                        'bench_baseline.json')
+
+WORDS = ("the quick brown fox jumps over lazy dog speed pad typing "
+         "keyboard quote line cursor buffer screen stats robot player "
+         "index corpus fortune journal session").split()
+
+
+#########################################################################
+
+
+def prose(rng, lines=40, width=69):
+    """Generate wrapped text of random words"""
+    result = []
+    for ypos in range(lines):
+        line = []
+        while True:
+            word = rng.choice(WORDS)
+            if len(' '.join(line + [word])) >= width:
+                break
+            line.append(word)
+        result.append(' '.join(line))
+    return result
+
+
+def code(rng, functions=8, tabsize=4):
+    """Generate C-like source with nested blocks and comments"""
+    result = []
+    for n in range(functions):
+        result.append("/*")
+        for i in range(rng.randint(1, 3)):
+            result.append(" * %s" % ' '.join(rng.sample(WORDS, 5)))
+        result.append(" */")
+        result.append("int %s_%d(int %s)" % (rng.choice(WORDS), n,
+                                               rng.choice(WORDS)))
+        result.append("{")
+        depth = 1
+        for i in range(rng.randint(4, 12)):
+            indent = ' ' * (depth * tabsize)
+            kind = rng.random()
+            if kind < 0.2 and depth < 4:
+                result.append(indent + "if (%s) {" % rng.choice(WORDS))
+                depth += 1
+            elif kind < 0.35 and depth > 1:
+                depth -= 1
+                result.append(' ' * (depth * tabsize) + "}")
+            elif kind < 0.5:
+                result.append(indent + "// %s" %
+                              ' '.join(rng.sample(WORDS, 4)))
+                result.append(indent + "// %s" %
+                              ' '.join(rng.sample(WORDS, 3)))
+            else:
+                result.append(indent + "%s = %s(%d);" % (
+                        rng.choice(WORDS), rng.choice(WORDS),
+                        rng.randint(0, 999)))
+        while depth > 1:
+            depth -= 1
+            result.append(' ' * (depth * tabsize) + "}")
+        result.append("}")
+    return result
+
+
+def typist(lines, options, rng, typorate=0.0, burst=1):
+    """Simulate a typist and return the keys pressed
+
+    The typist looks at the cursor of a live session, so keys inserted by
+    the session itself (indentation, comment continuation) are skipped.
+    Typos left of the cursor, typed or inserted, are fixed right away.
+    """
+    quote = speedpad.Quote(lines)
+    session = speedpad.TypingSession(
+            buffer=speedpad.InputBuffer(speedpad.SpeedPad.PAD_YMAX,
+                                        speedpad.SpeedPad.PAD_XMAX),
+            **options)
+    keys = []
+    def press(ch):
+        keys.append(ch)
+        session.feed(quote, [ch])
+    try:
+        while len(keys) < 20 * quote.strlen + 100:
+            ypos, xpos = session.buffer.getyx()
+            if quote.iscomplete(ypos, xpos):
+                break
+            if any(quote.stats.typos.get((ypos, i)) for i in range(xpos)):
+                press(curses.ascii.BS)
+                continue
+            if quote.iseol(ypos, xpos):
+                press(curses.ascii.NL)
+                continue
+            line = quote.lines[ypos]
+            sol = len(line) - len(line.lstrip())
+            nexttab = session.tabsize and (
+                    xpos // session.tabsize + 1) * session.tabsize
+            if xpos < sol and nexttab and nexttab <= sol:
+                press(curses.ascii.TAB)
+                continue
+            if rng.random() < typorate:
+                for i in range(min(burst, len(line) - xpos)):
+                    press(ord(rng.choice('qwxzjk')))
+                continue
+            press(ord(line[xpos]))
+    except speedpad.QuoteStopSignal:
+        pass
+    return keys
+
+
+def scenarios(seed=1):
+    """Return the synthetic streams as (name, lines, options, keys)"""
+    rng = random.Random(seed)
+    text = prose(rng)
+    source = code(rng)
+    plain = dict(tabsize=8)
+    coding = dict(tabsize=4, indent=True, syntax=True)
+    result = []
+    for name, lines, options, typorate, burst in (
+            ('prose', text, plain, 0.0, 1),
+            ('prose-typos', text, plain, 0.05, 1),
+            ('prose-bursts', text, plain, 0.02, 6),
+            ('code', source, coding, 0.0, 1),
+            ('code-typos', source, coding, 0.05, 2),
+    ):
+        keys = typist(lines, options, random.Random(seed), typorate, burst)
+        result.append((name, lines, options, keys))
+    return result
+
+
+#########################################################################
+
+
+class Runner(object):
+    """Feed keys through the input path and time every key"""
+
+    def __init__(self, lines, options):
+        self.lines = lines
+        self.options = options
+
+    def setup(self):
+        self.session = speedpad.TypingSession(
+                buffer=speedpad.InputBuffer(speedpad.SpeedPad.PAD_YMAX,
+                                            speedpad.SpeedPad.PAD_XMAX),
+                **self.options)
+
+    def start(self):
+        self.session.reset()
+        return speedpad.Quote(self.lines)
+
+    def step(self, quote, ch):
+        self.session.feed(quote, [ch])
+        del self.session.marks[:]
+
+    def run(self, keys, rounds):
+        self.setup()
+        latencies = []
+        gc.collect()
+        blocks = allocated()
+        started = clock()
+        for n in range(rounds):
+            quote = self.start()
+            for ch in keys:
+                t = clock()
+                try:
+                    self.step(quote, ch)
+                except speedpad.QuoteStopSignal:
+                    pass
+                latencies.append(clock() - t)
+        elapsed = clock() - started
+        blocks = allocated() - blocks
+        return elapsed, latencies, blocks
+
+
+class CursesRunner(Runner):
+    """Feed keys through SpeedPad.process onto off-screen pads"""
+
+    def setup(self):
+        self.instance = speedpad.SpeedPad(player=speedpad.Player("bench"),
+                                          **self.options)
+        self.instance.initscreen()
+        self.instance.initplayers()
+
+    def start(self):
+        quote = speedpad.Quote(self.lines)
+        self.instance.session.reset()
+        self.instance.quotebox.reset()
+        self.instance.inputbox.reset()
+        self.instance.speedbox.load(quote)
+        self.instance.quotebox.load(quote)
+        return quote
+
+    def step(self, quote, ch):
+        instance = self.instance
+        instance.process(quote, ch, [ch])
+        while instance.queue:
+            ch = instance.queue.popleft()
+            instance.process(quote, ch, [ch], keyboard=False)
+
+
+def allocated():
+    """Number of allocated memory blocks (live gc objects on Python 2)"""
+    if hasattr(sys, 'getallocatedblocks'):
+        return sys.getallocatedblocks()
+    return len(gc.get_objects())
+
+
+def hotpaths(lines, rounds):
+    """Time the primitives called for every key"""
+    quote = speedpad.Quote(lines)
+    buf = speedpad.InputBuffer(speedpad.SpeedPad.PAD_YMAX,
+                               speedpad.SpeedPad.PAD_XMAX)
+    for ch in '\n'.join(lines):
+        buf.putch(ord(ch))
+    positions = [(ypos, xpos) for ypos, line in enumerate(lines)
+                 for xpos in range(0, len(line), 3)]
+    comments = [ypos for ypos, line in enumerate(lines)
+                if line.lstrip()[:1] in ('/', '*')]
+    def strpos():
+        for ypos, xpos in positions:
+            quote.strpos(ypos, xpos)
+    def eol():
+        for ypos in range(len(lines)):
+            buf.eol(ypos)
+            buf.sol(ypos)
+    def continue_comment():
+        for ypos in comments:
+            sol = buf.sol(ypos)
+            buf.continue_comment(ypos, sol, quote.eol(ypos),
+                                 quote.eol(ypos + 1), indent=True)
+    # the adaptive robot updates its model and schedule once per round
+    model = speedpad.PaceModel(5.0, margin=0.1)
+    for char in set(''.join(lines[::3])):
+        quote.stats.typocounts.add(char, 'x')
+    def pace_update():
+        model.update(6.0, quote)
+    def pace_schedule():
+        model.schedule(quote)
+    # a resize wraps the quote of the round again, half of it typed
+    quotegen = speedpad.QuoteGenerator(lambda maxsize: [], len(lines), 1000,
+                                       wrap=0, width=40, strip=False)
+    raw = '\n'.join(lines)
+    narrow = quotegen.wrap(raw)
+    quotegen.wrapper.width = 60
+    wide = quotegen.wrap(raw)
+    wrapped = speedpad.Quote(*narrow)
+    session = speedpad.TypingSession()
+    session.feed(wrapped, [ord(ch) for ch in
+                           '\n'.join(wrapped.lines)[:wrapped.strlen // 2]])
+    def wrap():
+        quotegen.wrap(raw)
+    def reflow():
+        session.reflow(wrapped, *wide)
+        session.reflow(wrapped, *narrow)
+    result = []
+    for name, func, calls in (('strpos', strpos, len(positions)),
+                              ('eol', eol, 2 * len(lines)),
+                              ('continue_comment', continue_comment,
+                               len(comments)),
+                              ('pace_update', pace_update, 1),
+                              ('pace_schedule', pace_schedule, 1),
+                              ('wrap', wrap, 1),
+                              ('reflow', reflow, 2)):
+        started = clock()
+        for n in range(rounds):
+            func()
+        result.append((name, calls * rounds / (clock() - started)))
+    return result
+
+
+def report(name, keys, elapsed, latencies, blocks):
+    latencies.sort()
+    rate = len(latencies) / elapsed
+    print("%-16s %9d keys %10.0f keys/s  p50 %6.1fus  p90 %6.1fus  "
+          "p99 %6.1fus  max %7.1fus  %+d blocks" % (
+          name, len(keys), rate,
+          speedpad.percentile(latencies, 50) * 1e6,
+          speedpad.percentile(latencies, 90) * 1e6,
+          speedpad.percentile(latencies, 99) * 1e6,
+          latencies[-1] * 1e6, blocks))
+    return rate
+
+
+def compare(results, baseline, tolerance):
+    """Return names of results slower than their baseline"""
+    regressions = []
+    for name, rate in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = rate / baseline[name]
+        if ratio < 1 - tolerance:
+            print("REGRESSION %s: %.0f/s vs. baseline %.0f/s (%.0f%%)" % (
+                  name, rate, baseline[name], ratio * 100))
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="benchmark the speedpad input path")
+    parser.add_argument('--rounds', type=int, default=20,
+                        help="replay each stream N times")
+    parser.add_argument('--seed', type=int, default=1,
+                        help="seed of the synthetic streams")
+    parser.add_argument('--curses', action='store_true',
+                        help="replay through SpeedPad.process and pads")
+    parser.add_argument('--replay', metavar='FILE', nargs='*', default=[],
+                        help="replay recorded streams instead")
+    parser.add_argument('--dump', metavar='DIR',
+                        help="record the synthetic streams to DIR")
+    parser.add_argument('--save', action='store_true',
+                        help="store results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE)
+    args = parser.parse_args()
+
+    if args.replay:
+        streams = []
+        for filename in args.replay:
+            with open(filename) as fh:
+                stream = json.load(fh)
+            streams.append((stream['name'], stream['lines'],
+                            stream['options'], stream['keys']))
+    else:
+        streams = scenarios(args.seed)
+
+    if args.dump:
+        for name, lines, options, keys in streams:
+            filename = os.path.join(args.dump, name + '.json')
+            with open(filename, 'w') as fh:
+                json.dump(dict(name=name, lines=lines, options=options,
+                               keys=keys), fh)
+        return 0
+
+    mode = 'curses' if args.curses else 'session'
+    results = collections.OrderedDict()
+    if args.curses:
+        stdscr = curses.initscr()
+    try:
+        measured = []
+        for name, lines, options, keys in streams:
+            runner = (CursesRunner if args.curses else Runner)(lines, options)
+            measured.append((name, keys) + runner.run(keys, args.rounds))
+    finally:
+        if args.curses:
+            curses.endwin()
+    print("%s, %d rounds" % (mode, args.rounds))
+    for name, keys, elapsed, latencies, blocks in measured:
+        results['%s/%s' % (mode, name)] = report(name, keys, elapsed,
+                                                 latencies, blocks)
+    if not args.replay:
+        name, source, options, keys = streams[-1]
+        for hotpath, rate in hotpaths(source, args.rounds * 10):
+            print("%-16s %27.0f calls/s" % (hotpath, rate))
+            results['hotpath/%s' % hotpath] = rate
+        pace = (1.0 / results['hotpath/pace_update'] +
+                1.0 / results['hotpath/pace_schedule'])
+        replay = len(keys) / results['%s/%s' % (mode, name)]
+        played = len(keys) / 5.0    # at 60 WPM
+        print("adaptive robot %8.1fus per round, %.2f%% of replaying %s, "
+              "%.5f%% of playing it" % (pace * 1e6, pace / replay * 100,
+                                        name, pace / played * 100))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            fh.write('\n')
+        return 0
+    return 1 if compare(results, baseline, args.tolerance) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et sw=4 sts=4 ts=4 tw=78 fen fdm=indent fdn=2 fdl=0
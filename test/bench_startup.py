@@ -0,0 +1,152 @@
+# Copyright (C) 2011 John Feuerstein <john@feurix.com>
+#
+# This file is part of the speedpad project.
+#
+# speedpad is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# speedpad is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Measure the cold start time of speedpad
+
+Runs speedpad in a pseudo terminal and measures the wall time from spawning
+the interpreter until the first quote shows up on the screen, as well as
+the time of a bare --version run (interpreter and module load only).
+The median of --runs runs is compared against the stored baselines in
+bench_baseline.json like bench_speedpad.py does.
+
+    python bench_startup.py [--python INTERPRETER] [--save]
+"""
+
+import argparse
+import json
+import os
+import pty
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+SPEEDPAD = os.path.join(os.path.dirname(__file__) or '.',
+                        '..', 'bin', 'speedpad')
+BASELINE = os.path.join(os.path.dirname(__file__) or '.',
+                        'bench_baseline.json')
+QUOTE = b"the quick brown fox jumps over the lazy dog"
+
+
+def first_quote(python, filename, timeout=10.0):
+    """Return seconds until the quote was drawn in a terminal"""
+    started = clock()
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ['TERM'] = 'xterm'
+        os.execv(python, [python, SPEEDPAD, '--no-stats', filename])
+    output = b''
+    elapsed = None
+    try:
+        while clock() - started < timeout:
+            ready, _, _ = select.select([fd], [], [], 0.01)
+            if not ready:
+                continue
+            try:
+                output += os.read(fd, 65536)
+            except OSError:
+                break
+            if QUOTE in output:
+                elapsed = clock() - started
+                break
+        os.write(fd, b'\x11')   # ^Q
+    finally:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+        os.waitpid(pid, 0)
+        os.close(fd)
+    if elapsed is None:
+        raise RuntimeError("no quote within %.1f seconds" % timeout)
+    return elapsed
+
+
+def version(python):
+    started = clock()
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call([python, SPEEDPAD, '--version'],
+                              stdout=devnull, stderr=devnull)
+    return clock() - started
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="benchmark the speedpad cold start")
+    parser.add_argument('--python', default=sys.executable,
+                        help="interpreter to run speedpad with")
+    parser.add_argument('--runs', type=int, default=15,
+                        help="take the median of N runs")
+    parser.add_argument('--save', action='store_true',
+                        help="store results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE)
+    args = parser.parse_args()
+
+    fd, filename = tempfile.mkstemp()
+    try:
+        os.write(fd, QUOTE + b'\n')
+        os.close(fd)
+        results = {
+            'startup/version': median([version(args.python)
+                                       for n in range(args.runs)]),
+            'startup/first-quote': median([first_quote(args.python, filename)
+                                           for n in range(args.runs)]),
+        }
+    finally:
+        os.unlink(filename)
+    for name, seconds in sorted(results.items()):
+        print("%-20s %8.1f ms" % (name, seconds * 1e3))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            fh.write('\n')
+        return 0
+    regressions = 0
+    for name, seconds in sorted(results.items()):
+        limit = baseline.get(name)
+        if limit is not None and seconds > limit * (1 + args.tolerance):
+            print("REGRESSION %s: %.1f ms vs. baseline %.1f ms" % (
+                  name, seconds * 1e3, baseline[name] * 1e3))
+            regressions += 1
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et sw=4 sts=4 ts=4 tw=78 fen fdm=indent fdn=2 fdl=0
@@ -16,15 +16,39 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import codecs
 import curses
 import curses.ascii
-import imp
+import mmap
+import os
+import shutil
 import sys
+import tempfile
+import textwrap
+import time
 import unittest
 
-imp.load_source('speedpad', '../bin/speedpad')
+def load_source(name, pathname):
+    try:
+        from importlib.machinery import SourceFileLoader
+        from importlib.util import module_from_spec, spec_from_loader
+    except ImportError:
+        import imp
+        return imp.load_source(name, pathname)
+    loader = SourceFileLoader(name, pathname)
+    module = module_from_spec(spec_from_loader(name, loader))
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+load_source('speedpad', '../bin/speedpad')
 import speedpad
 
+try:
+    xrange
+except NameError:
+    xrange = range
+
 stdscr = None
 
 def start_curses():
@@ -142,6 +166,148 @@ class TestSpeedUnits(TestCase):
         self.assertEqual(str(speedpad.cph), 'CPH')
 
 
+class TestKeystrokeLog(TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.keylog = speedpad.KeystrokeLog(size=3, clock=lambda: self.now)
+
+    def record(self, *args):
+        self.now += 0.5
+        self.keylog.record(*args)
+
+    def test_record(self):
+        self.assertEqual(len(self.keylog), 0)
+        self.assertEqual(list(self.keylog), [])
+        self.record(0, 'a', 'a', True)
+        self.record(1, 'b', 'x', False)
+        self.assertEqual(list(self.keylog), [
+                (100.5, 0, ord('a'), ord('a'), True),
+                (101.0, 1, ord('b'), ord('x'), False),
+        ])
+        # overwrite oldest events
+        self.record(1, '', '\b', False)
+        self.record(1, 'b', 'b', True)
+        self.assertEqual(len(self.keylog), 3)
+        self.assertEqual(list(self.keylog), [
+                (101.0, 1, ord('b'), ord('x'), False),
+                (101.5, 1, -1, 8, False),
+                (102.0, 1, ord('b'), ord('b'), True),
+        ])
+        self.keylog.reset()
+        self.assertEqual(list(self.keylog), [])
+        self.assertRaises(ValueError, speedpad.KeystrokeLog, size=0)
+
+    def test_dump(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'keylog')
+            self.record(0, 'a', 'a', True)
+            self.record(1, 'b', 'x', False)
+            for n in xrange(2):
+                with open(filename, 'ab') as fh:
+                    self.keylog.dump(fh, 1000.0)
+            with open(filename, 'rb') as fh:
+                lines = fh.read().decode('ascii').splitlines()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(lines, [
+                speedpad.KeystrokeLog.HEADER,
+                "1000.000 0.000000 0 97 97 1",
+                "1000.000 0.500000 1 98 120 0",
+                "1000.000 0.000000 0 97 97 1",
+                "1000.000 0.500000 1 98 120 0",
+        ])
+
+
+class TestRecording(TestCase):
+
+    samples = [(0.0, 1), (0.25, 2), (0.5, 1), (0.75, 2), (300.125, 1000)]
+
+    def test_pos(self):
+        recording = speedpad.Recording(self.samples)
+        self.assertEqual(len(recording), 5)
+        self.assertEqual(recording.elapsed, 300.125)
+        self.assertEqual(recording.pos(-1.0), 0)
+        self.assertEqual(recording.pos(0.0), 1)
+        self.assertEqual(recording.pos(0.6), 1)
+        self.assertEqual(recording.pos(1.0), 2)
+        self.assertEqual(recording.pos(1000.0), 1000)
+        self.assertEqual(speedpad.Recording().elapsed, 0.0)
+
+    def test_encode(self):
+        data = speedpad.Recording(self.samples).encode()
+        self.assertEqual(len(data), 16)
+        self.assertEqual(list(speedpad.Recording.decode(data)), self.samples)
+        self.assertEqual(list(speedpad.Recording.decode(b'')), [])
+        # times are stored in milliseconds and never go back
+        data = speedpad.Recording([(1.0004, 1), (0.5, 2)]).encode()
+        self.assertEqual(list(speedpad.Recording.decode(data)),
+                         [(1.0, 1), (1.0, 2)])
+
+
+class TestNgramStats(TestCase):
+
+    def events(self, s, typos=(), start=0.0, step=0.1):
+        # type s, one keystroke per step, with typos at given positions
+        res = []
+        time = start
+        for pos, char in enumerate(s):
+            if pos in typos:
+                res.append((time, pos, ord(char), ord('#'), False))
+                time += step
+                res.append((time, pos, -1, 8, False))
+                time += step
+            res.append((time, pos, ord(char), ord(char), True))
+            time += step
+        return res
+
+    def test_bigrams(self):
+        stats = speedpad.NgramStats(2)
+        stats.add(self.events("abab"))
+        self.assertEqual(len(stats), 2)
+        count, mean, p50, p90, p99, attempts, typos, rate = \
+                stats.summary(u"ab")
+        self.assertEqual((count, attempts, typos), (2, 2, 0))
+        self.assertAlmostEqual(mean, 0.1)
+        self.assertEqual(stats.summary(u"ba")[0], 1)
+        # typo on second char of "ab", backspace breaks the sequence
+        stats.add(self.events("ab", typos=(1,), step=0.2))
+        count, mean, p50, p90, p99, attempts, typos, rate = \
+                stats.summary(u"ab")
+        self.assertEqual((count, attempts, typos), (2, 3, 1))
+        self.assertAlmostEqual(rate, 1 / 3.0)
+        self.assertEqual(stats.summary(u"xy"), (0, 0.0, 0.0, 0.0, 0.0,
+                                                 0, 0, 0.0))
+
+    def test_trigrams(self):
+        stats = speedpad.NgramStats(3)
+        stats.add(self.events("abcd", step=0.1))
+        stats.add(self.events("abc", step=0.3))
+        self.assertEqual(sorted(stats.attempts), [u"abc", u"bcd"])
+        count, mean, p50, p90, p99, attempts, typos, rate = \
+                stats.summary(u"abc")
+        self.assertAlmostEqual(mean, 0.4)
+        self.assertAlmostEqual(p50, 0.2)
+        self.assertAlmostEqual(p99, 0.6)
+        self.assertEqual([ngram for ngram, summary in stats.slowest()],
+                         [u"abc", u"bcd"])
+        self.assertEqual(len(stats.slowest(1)), 1)
+        self.assertRaises(ValueError, speedpad.NgramStats, 1)
+
+    def test_format(self):
+        stats = speedpad.NgramStats(2)
+        stats.add(self.events("a b"))
+        self.assertEqual(speedpad.format_ngram_stats([stats]).splitlines(), [
+                speedpad.NgramStats.HEADER,
+                "2 \\x20b 1 0.100000 0.100000 0.100000 0.100000 1 0 0.000000",
+                "2 a\\x20 1 0.100000 0.100000 0.100000 0.100000 1 0 0.000000",
+        ])
+        self.assertEqual(speedpad.escape_ngram(u"\\\u20ac"),
+                         "\\x5c\\u20ac")
+        self.assertEqual(speedpad.percentile([], 50), 0.0)
+
+
 class TestQuote(TestCase):
 
     def test_inrange(self):
@@ -157,6 +323,11 @@ class TestQuote(TestCase):
         self.assertFalse(quote.inrange(2, 0))
         self.assertFalse(quote.inrange(1, 7))
 
+    def test_digest(self):
+        quote = speedpad.Quote(["foo", "bar"])
+        self.assertEqual(len(quote.digest), 40)
+        self.assertEqual(quote.digest, speedpad.Quote(["foo", "bar"]).digest)
+        self.assertNotEqual(quote.digest, speedpad.Quote(["foobar"]).digest)
 
     def test_strpos(self):
         quote = speedpad.Quote([
@@ -171,6 +342,61 @@ class TestQuote(TestCase):
         self.assertRaises(IndexError, quote.strpos, -1, -1)
         self.assertEqual(quote.strpos(9, 9), quote.strlen)
 
+    def test_yxpos(self):
+        quote = speedpad.Quote([
+                "foo bar",
+                "",
+                "",
+                "qux bux",
+        ])
+        self.assertEqual(quote.yxpos(0), (0, 0))
+        self.assertEqual(quote.yxpos(6), (0, 6))
+        self.assertEqual(quote.yxpos(7), (3, 0))
+        self.assertEqual(quote.yxpos(8), (3, 1))
+        self.assertEqual(quote.yxpos(14), (3, 7))
+        self.assertEqual(quote.yxpos(99), (3, 7))
+        self.assertRaises(IndexError, quote.yxpos, -1)
+        for pos in xrange(quote.strlen + 1):
+            self.assertEqual(quote.strpos(*quote.yxpos(pos)), pos)
+
+    def test_locate(self):
+        # "foo bar baz" wrapped at 7, "" and "qux" as is
+        quote = speedpad.Quote(["foo bar", "baz", "", "qux"],
+                               [(0, 0), (0, 8), (1, 0), (2, 0)])
+        self.assertEqual(quote.source(0, 4), (0, 4))
+        self.assertEqual(quote.source(1, 2), (0, 10))
+        self.assertEqual(quote.source(3, 1), (2, 1))
+        self.assertEqual(quote.locate(0, 10), (1, 2))
+        self.assertEqual(quote.locate(2, 1), (3, 1))
+        # the space dropped at the break is the end of the line before
+        self.assertEqual(quote.locate(0, 7), (0, 7))
+        self.assertEqual(quote.locate(0, 11), (1, 3))
+        self.assertEqual(quote.locate(9, 0), (3, 3))
+        # typos follow their chars
+        quote.stats.addtypo(1, 1)
+        quote.stats.addtypo(3, 0)
+        quote.stats.fixtypo(3, 0)
+        quote.reflow(["foo bar baz", "", "qux"], [(0, 0), (1, 0), (2, 0)])
+        self.assertEqual(quote.strlen, 14)
+        self.assertEqual(quote.stats.typos, {(0, 9): True, (2, 0): False})
+
+    def test_textpos(self):
+        quote = speedpad.Quote(["foo bar", "baz", "", "qux"],
+                               [(0, 0), (0, 8), (1, 0), (2, 0)])
+        self.assertEqual(quote.strlen, 13)
+        self.assertEqual([quote.textpos(pos) for pos in (0, 5, 7, 10, 13)],
+                         [0, 5, 8, 11, 14])
+        # the space dropped at the break waits at the end of the line
+        self.assertEqual(quote.wrappos(7), 7)
+        self.assertEqual([quote.wrappos(pos) for pos in (0, 5, 8, 11, 14)],
+                         [0, 5, 7, 10, 13])
+        quote.reflow(["foo bar baz", "", "qux"], [(0, 0), (1, 0), (2, 0)])
+        self.assertEqual([quote.textpos(pos) for pos in (0, 5, 8, 11, 14)],
+                         [0, 5, 8, 11, 14])
+        self.assertEqual([quote.wrappos(pos) for pos in (0, 5, 8, 11, 14)],
+                         [0, 5, 8, 11, 14])
+        self.assertEqual(quote.wrappos(99), quote.strlen)
+
     def test_istypo(self):
         quote = speedpad.Quote([
                 "foo bar",
@@ -314,19 +540,19 @@ class TestQuoteGenerator(TestCase):
 
     def test_iterator(self):
         quotegen = speedpad.QuoteGenerator(self.factory, 2, 10)
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         self.assertEqual(quote, self.raw[:20])
 
     def test_iteration(self):
         quotegen = speedpad.QuoteGenerator(self.factory, 2, 10)
-        quote = quotegen.next()
+        quote = next(quotegen)
         self.assertTrue(isinstance(quote, speedpad.Quote))
         self.assertEqual(quote.strlen, 20)
         self.assertEqual(quote.lines, [self.raw[:10], self.raw[10:20]])
 
     def test_clean(self):
         quotegen = speedpad.QuoteGenerator(self.factory, 2, 10)
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         # input too long
         quotegen.wrapper.width = 20
         clean = quotegen.clean(quote)
@@ -343,13 +569,13 @@ class TestQuoteGenerator(TestCase):
         quotegen = speedpad.QuoteGenerator(self.factory, 1, 50, strip=True)
         self.raw = " foo barbaz    qux "
         expect = [  "foo barbaz qux"     ]
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         quotegen = speedpad.QuoteGenerator(self.factory, 1, 50, strip=False)
         self.raw = " foo barbaz    qux "
         expect = [ " foo barbaz    qux"  ]
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         # tab expansion
@@ -357,14 +583,14 @@ class TestQuoteGenerator(TestCase):
                                            strip=False, tabsize=8)
         self.raw = " foo\tbarbaz    qux "
         expect = [ " foo    barbaz    qux"  ]
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         quotegen = speedpad.QuoteGenerator(self.factory, 1, 50,
                                            strip=False, tabsize=5)
         self.raw = " foo\tbarbaz    qux "
         expect = [ " foo barbaz    qux"  ]
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         # wrap
@@ -390,29 +616,82 @@ class TestQuoteGenerator(TestCase):
                 "zzz",
                 "",
         ]
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         # same with wrap past last column
         quotegen = speedpad.QuoteGenerator(self.factory, 10, 10,
                                            strip=False, tabsize=4, wrap=20)
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         # same with auto wrap
         quotegen = speedpad.QuoteGenerator(self.factory, 10, 10,
                                            strip=False, tabsize=4, wrap=0)
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
         # same with auto wrap and default width
         quotegen = speedpad.QuoteGenerator(self.factory, 10, 50,
                                            strip=False, tabsize=4,
                                            wrap=0, width=10)
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertEqual(clean, expect)
 
+    def test_wrapper(self):
+        wrapper = speedpad.LineWrapper(10)
+        self.assertEqual(wrapper.wrap("foo bar baz qux"),
+                         ["foo bar", "baz qux"])
+        self.assertEqual(wrapper.spans("foo bar baz qux"),
+                         [(0, 7), (8, 15)])
+        # leading spaces of the paragraph are kept, spaces at breaks not
+        self.assertEqual(wrapper.wrap("  foo bar   baz"),
+                         ["  foo bar", "baz"])
+        # long words fill up the line, no breaks at hyphens
+        self.assertEqual(wrapper.wrap("foo abcdefghijklmnop bar-baz-qux"),
+                         ["foo abcdef", "ghijklmnop", "bar-baz-qu", "x"])
+        for width in xrange(1, 30):
+            wrapper.width = width
+            textwrapper = textwrap.TextWrapper(width=width,
+                                               break_on_hyphens=False)
+            for text in ("the quick brown fox jumps over the lazy dog",
+                         " a bb ccc dddd eeeee ffffff ggggggg hhhhhhhh"):
+                self.assertEqual(wrapper.wrap(text),
+                                 [line.rstrip() for line in
+                                  textwrapper.wrap(text)])
+
+    def test_layout(self):
+        quotegen = speedpad.QuoteGenerator(self.factory, 10, 50, wrap=0,
+                                           width=8, strip=False)
+        self.raw = "foo bar baz\n\nqux"
+        lines, sources = quotegen.layout(self.raw)
+        self.assertEqual(lines, ["foo bar", "baz", "", "qux"])
+        self.assertEqual(sources, [(0, 0), (0, 8), (1, 0), (2, 0)])
+        # cached by width
+        self.assertTrue(quotegen.layout(self.raw)[0] is lines)
+        quotegen.resize(0, 10)
+        self.assertEqual(quotegen.layout(self.raw)[0],
+                         ["foo bar baz", "", "qux"])
+        quotegen.resize(0, -10)
+        self.assertTrue(quotegen.layout(self.raw)[0] is lines)
+        quote = quotegen.make_quote(self.raw)
+        self.assertEqual(quote.raw, self.raw)
+        self.assertEqual(quote.sources, sources)
+
+    def test_digest(self):
+        quotegen = speedpad.QuoteGenerator(self.factory, 10, 50, wrap=0,
+                                           width=8)
+        self.raw = "foo bar baz\n\nqux"
+        narrow = quotegen.make_quote(self.raw)
+        quotegen.resize(0, 10)
+        wide = quotegen.make_quote(self.raw)
+        self.assertNotEqual(narrow.lines, wide.lines)
+        self.assertEqual(narrow.digest, wide.digest)
+        quotegen.strip = False
+        self.assertNotEqual(quotegen.make_quote(self.raw).digest,
+                            wide.digest)
+
     def test_resize(self):
         self.raw = (
                 " foo\tbarbaz    qux \n"
@@ -436,7 +715,7 @@ class TestQuoteGenerator(TestCase):
         ]
         quotegen = speedpad.QuoteGenerator(self.factory, 10, 50,
                                            strip=False, tabsize=4, wrap=0)
-        quote = quotegen.iterator.next()
+        quote = next(quotegen.iterator)
         clean = quotegen.clean(quote)
         self.assertNotEqual(clean, expect)
         quotegen.resize(0, -40)
@@ -444,6 +723,96 @@ class TestQuoteGenerator(TestCase):
         self.assertEqual(clean, expect)
 
 
+    def test_prefetch(self):
+        def factory(maxsize):
+            for n in xrange(5):
+                yield str(n) * maxsize
+        quotegen = speedpad.QuoteGenerator(factory, 1, 3, prefetch=2)
+        lines = [quote.lines for quote in quotegen]
+        self.assertEqual(lines, [[str(n) * 3] for n in xrange(5)])
+        # each worker runs its own iterator
+        quotegen = speedpad.QuoteGenerator(factory, 1, 3,
+                                           prefetch=2, workers=3)
+        lines = sorted(quote.lines for quote in quotegen)
+        self.assertEqual(lines, sorted([[str(n) * 3] for n in xrange(5)] * 3))
+        # rewrap quotes prefetched before a resize
+        quotegen = speedpad.QuoteGenerator(self.factory, 10, 10, prefetch=1)
+        quote = next(quotegen)
+        self.assertEqual(quote.lines[0], self.raw[:10])
+        quotegen.resize(0, -5)
+        quote = next(quotegen)
+        self.assertEqual(quote.lines[0], self.raw[:5])
+        # errors are raised in the consumer
+        def factory(maxsize):
+            yield "foo"
+            raise speedpad.QuoteCommandLineError("bar")
+        quotegen = speedpad.QuoteGenerator(factory, 1, 3, prefetch=2)
+        self.assertEqual(next(quotegen).lines, ["foo"])
+        self.assertRaises(speedpad.QuoteCommandLineError, quotegen.next)
+
+
+class TestTypoMatrix(TestCase):
+
+    def test_add(self):
+        matrix = speedpad.TypoMatrix()
+        self.assertFalse(matrix)
+        matrix.add('a', 's')
+        matrix.add('a', 's')
+        matrix.add('a', u'\xe4')
+        matrix.add(u'\xe9', 'e', 3)
+        self.assertEqual(matrix.get('a', 's'), 2)
+        self.assertEqual(matrix['a'][u'\xe4'], 1)
+        self.assertEqual(matrix[u'\xe9']['e'], 3)
+        self.assertEqual(matrix['b']['s'], 0)
+        self.assertEqual(matrix.total('a'), 3)
+        self.assertEqual(sorted(matrix), ['a', u'\xe9'])
+        self.assertIn('a', matrix)
+        self.assertNotIn('b', matrix)
+        self.assertIn('s', matrix['a'])
+        self.assertNotIn('d', matrix['a'])
+        self.assertEqual(sorted(matrix['a'].items()),
+                         [('s', 2), (u'\xe4', 1)])
+        matrix['a']['s'] += 1
+        self.assertEqual(matrix.total('a'), 4)
+        matrix.clear()
+        self.assertFalse(matrix)
+        self.assertEqual(matrix.get('a', 's'), 0)
+
+    def test_top(self):
+        matrix = speedpad.TypoMatrix()
+        for expected, typed, count in (('f', 'a', 3), ('f', 'b', 2),
+                                       ('r', 'f', 5), ('o', 'b', 3),
+                                       ('o', 'c', 1), ('a', 'e', 1),
+                                       (u'\xe9', 'e', 1)):
+            matrix.add(expected, typed, count)
+        self.assertEqual(matrix.top(3), [
+                ('f', [('a', 3), ('b', 2)]),
+                ('r', [('f', 5)]),
+                ('o', [('b', 3), ('c', 1)]),
+        ])
+        self.assertEqual(matrix.top()[3:], [
+                ('a', [('e', 1)]),
+                (u'\xe9', [('e', 1)]),
+        ])
+
+    def test_merge(self):
+        rounds = [speedpad.TypoMatrix() for n in xrange(3)]
+        rounds[0].add('a', 's')
+        rounds[1].add('a', 's', 2)
+        rounds[1].add(u'\xe9', 'e')
+        rounds[2].add(u'\xe9', 'e')
+        lifetime = speedpad.TypoMatrix()
+        for matrix in rounds:
+            lifetime.merge(matrix)
+        self.assertEqual(lifetime.top(), [
+                ('a', [('s', 3)]),
+                (u'\xe9', [('e', 2)]),
+        ])
+        # merged counts are copies
+        rounds[0].add('a', 's')
+        self.assertEqual(lifetime.get('a', 's'), 3)
+
+
 class TestInputStats(TestCase):
 
     def test_addtypo(self):
@@ -529,6 +898,460 @@ class TestInputStats(TestCase):
         self.assertEqual(stats.keystrokes_enter, 0)
 
 
+class TestCorpus(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'corpus')
+        with open(self.filename, 'wb') as fh:
+            fh.write(b"foo\nbar\n%\nbaz\n\n  \n%\n\nqux")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read(self):
+        corpus = speedpad.Corpus(self.filename)
+        self.assertEqual(len(corpus), 3)
+        self.assertEqual(corpus.read(0), b"foo\nbar\n")
+        self.assertEqual(corpus.read(1), b"baz\n")
+        self.assertEqual(corpus.read(2), b"qux")
+        self.assertEqual(corpus.read(0, maxsize=2), b"fo")
+        self.assertRaises(IndexError, corpus.read, 3)
+        self.assertRaises(IndexError, corpus.read, -1)
+        corpus.close()
+
+    def test_index(self):
+        corpus = speedpad.Corpus(self.filename)
+        self.assertFalse(isinstance(corpus.index, mmap.mmap))
+        self.assertTrue(os.path.exists(corpus.indexfile))
+        corpus.close()
+        # reuse index
+        corpus = speedpad.Corpus(self.filename)
+        self.assertTrue(isinstance(corpus.index, mmap.mmap))
+        self.assertEqual(corpus.read(2), b"qux")
+        corpus.close()
+        # rebuild stale index
+        with open(self.filename, 'ab') as fh:
+            fh.write(b"\n\nquux")
+        corpus = speedpad.Corpus(self.filename)
+        self.assertFalse(isinstance(corpus.index, mmap.mmap))
+        self.assertEqual(len(corpus), 4)
+        self.assertEqual(corpus.read(3), b"quux")
+        corpus.close()
+        # unwritable index location
+        corpus = speedpad.Corpus(self.filename, indexfile=os.path.join(
+                self.tmpdir, 'missing', 'index'))
+        self.assertEqual(len(corpus), 4)
+        corpus.close()
+
+    def test_empty(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write(b"\n%\n  \n")
+        self.assertRaises(ValueError, speedpad.Corpus, self.filename)
+        with open(self.filename, 'wb') as fh:
+            pass
+        self.assertRaises(ValueError, speedpad.Corpus, self.filename)
+
+
+class TestFortune(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, 'off'))
+        self.strfile('foo', [b"foo\n", b"foo bar\n", b"x" * 200 + b"\n"])
+        self.strfile('bar', [b"bar\n"])
+        self.strfile('baz', [b"one\n"], flags=0x4)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def strfile(self, name, strings, flags=0):
+        filename = os.path.join(self.tmpdir, name)
+        offsets = [0]
+        with open(filename, 'wb') as fh:
+            for string in strings:
+                fh.write(string + b"%\n")
+                offsets.append(fh.tell())
+        with open(filename + '.dat', 'wb') as fh:
+            fh.write(speedpad.struct.pack('>IIIIIc3x', 2, len(strings),
+                                          0, 0, flags, b'%'))
+            for offset in offsets:
+                fh.write(speedpad.struct.pack('>I', offset))
+
+    def test_read(self):
+        fortune = speedpad.FortuneFile(os.path.join(self.tmpdir, 'foo'))
+        self.assertEqual(len(fortune), 3)
+        self.assertEqual(fortune.read(0), b"foo\n")
+        self.assertEqual(fortune.read(1), b"foo bar\n")
+        self.assertEqual(fortune.read(1, maxsize=3), b"foo")
+        self.assertEqual(fortune.length(1), 8)
+        self.assertEqual(fortune.length(2), 201)
+        self.assertRaises(IndexError, fortune.read, 3)
+        fortune.close()
+        fortune = speedpad.FortuneFile(os.path.join(self.tmpdir, 'baz'))
+        self.assertEqual(fortune.read(0), b"bar\n")
+        fortune.close()
+
+    def test_source(self):
+        path = [self.tmpdir]
+        source = speedpad.FortuneSource([], path=path)
+        self.assertEqual(len(source.files), 3)
+        # weighted by number of strings
+        self.assertEqual(source.totals, [20.0, 40.0, 100.0])
+        source = speedpad.FortuneSource(['-e'], path=path)
+        self.assertEqual([round(total) for total in source.totals],
+                         [33, 67, 100])
+        source = speedpad.FortuneSource(['10%', 'bar', 'foo'], path=path)
+        self.assertEqual(source.totals, [10.0, 100.0])
+        source = speedpad.FortuneSource(['100%', 'bar', 'foo'], path=path)
+        self.assertEqual(source.totals, [100.0])
+        self.assertEqual(source.pick(), b"bar\n")
+        source = speedpad.FortuneSource(['-s', '-n', '5', 'foo'], path=path)
+        for n in xrange(20):
+            self.assertEqual(source.pick(), b"foo\n")
+        source = speedpad.FortuneSource(['-ln100', 'foo'], path=path)
+        self.assertEqual(source.pick(maxsize=3), b"xxx")
+        source = speedpad.FortuneSource(['-sn', '1', 'foo'], path=path)
+        self.assertRaises(ValueError, source.pick)
+        for args in (['-a'], ['-n'], ['x%', 'foo'], ['10%'],
+                     ['10%', 'foo'], ['60%', 'foo', '60%', 'bar'],
+                     ['missing']):
+            self.assertRaises(ValueError, speedpad.FortuneSource,
+                              args, path=path)
+        self.assertRaises(ValueError, speedpad.FortuneSource, [],
+                          path=[os.path.join(self.tmpdir, 'missing')])
+
+
+class TestStatsJournal(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'journal')
+        speed = speedpad.Speed(5.0)
+        self.stat = {
+            'started': 100.5, 'stopped': 110.5, 'elapsed': 10.0,
+            'len': 60, 'pos': 50, 'lines': 2, 'enter': 1, 'tab': 2,
+            'space': 9, 'good': 50, 'typo': 3, 'total': 53,
+            'cps': speedpad.cps(speed), 'cpm': speedpad.cpm(speed),
+            'wpm': speedpad.wpm(speed), 'ppm': speedpad.ppm(speed),
+            'cph': speedpad.cph(speed),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with open(self.filename, 'rb') as fh:
+            return list(speedpad.StatsJournal.read(fh))
+
+    def test_text(self):
+        journal = speedpad.StatsJournal.open(self.filename)
+        journal.write(self.stat)
+        # records are visible before close
+        self.assertEqual(self.read(), [self.stat])
+        journal.write(self.stat)
+        journal.close()
+        journal = speedpad.StatsJournal.open(self.filename, sync='fsync')
+        journal.write(self.stat)
+        journal.close()
+        self.assertEqual(self.read(), [self.stat] * 3)
+        with open(self.filename, 'rb') as fh:
+            lines = fh.read().decode('ascii').splitlines()
+        self.assertEqual(lines[0], speedpad.STATS_HEADER)
+        self.assertEqual(lines[1:],
+                         speedpad.format_stats([self.stat] * 3)
+                         .splitlines()[1:])
+
+    def test_binary(self):
+        journal = speedpad.StatsJournal.open(self.filename, format='binary')
+        journal.write(self.stat)
+        self.assertEqual(self.read(), [self.stat])
+        journal.write(self.stat)
+        journal.close()
+        self.assertEqual(os.path.getsize(self.filename),
+                         len(speedpad.StatsJournal.MAGIC) +
+                         2 * speedpad.StatsJournal.RECORD.size)
+        # ignore partial record at the end
+        with open(self.filename, 'ab') as fh:
+            fh.write(b"xx")
+        self.assertEqual(self.read(), [self.stat] * 2)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, speedpad.StatsJournal.open,
+                          self.filename, format='xml')
+        self.assertRaises(ValueError, speedpad.StatsJournal.open,
+                          self.filename, sync='never')
+
+
+class TestStatsHistory(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'history')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def stat(self, day, hour, speed, typo=0, total=50):
+        started = time.mktime((2011, 10, day, hour, 0, 0, 0, 0, -1))
+        return {
+            'started': started, 'stopped': started + 10.0, 'elapsed': 10.0,
+            'len': 50, 'pos': 50, 'lines': 1, 'enter': 0, 'tab': 0,
+            'space': 9, 'good': total - typo, 'typo': typo, 'total': total,
+            'cps': speed,
+        }
+
+    def test_rollups(self):
+        history = speedpad.StatsHistory.open(self.filename, user="foo",
+                                             source="quotes", mode="default")
+        history.write(self.stat(24, 9, 4.0, typo=5))    # Monday
+        history.write(self.stat(24, 18, 6.0))
+        history.write(self.stat(25, 12, 5.0, typo=5))   # Tuesday
+        history.write(self.stat(25, 13, 9.0, total=0))  # never started
+        history.close()
+        history = speedpad.StatsHistory.open(self.filename, user="bar",
+                                             source="quotes", mode="code")
+        history.write(self.stat(31, 12, 1.0))           # next Monday
+        days = history.rollups('day', user="foo")
+        self.assertEqual([(r['start'], r['rounds'], r['mean'], r['best'],
+                           r['typo'], r['total']) for r in days],
+                         [('2011-10-24', 2, 5.0, 6.0, 5, 100),
+                          ('2011-10-25', 1, 5.0, 5.0, 5, 50)])
+        weeks = history.rollups('week')
+        self.assertEqual([(r['start'], r['user'], r['mode'], r['rounds'],
+                           r['elapsed']) for r in weeks],
+                         [('2011-10-24', "foo", "default", 3, 30.0),
+                          ('2011-10-31', "bar", "code", 1, 10.0)])
+        rounds = history.db.execute("SELECT count(*) FROM rounds")
+        self.assertEqual(rounds.fetchone()[0], 4)
+        self.assertRaises(ValueError, history.rollups, 'month')
+        history.close()
+        lines = speedpad.format_history(weeks[:1], speedpad.cps).splitlines()
+        self.assertEqual(lines, [
+            "# start user mode rounds elapsed mean-cps best-cps typo-rate"
+            " source",
+            "2011-10-24 foo default 3 30.000 5.000 6.000 6.67 quotes",
+        ])
+        self.assertEqual(speedpad.format_history([]), '')
+
+    def test_main(self):
+        history = speedpad.StatsHistory.open(self.filename, user="foo")
+        history.write(self.stat(24, 9, 4.0))
+        history.close()
+        outfile = os.path.join(self.tmpdir, 'out')
+        with self.assertRaises(SystemExit) as cm:
+            speedpad.main(['--cps', '--user', 'foo', '--history',
+                           '--history-file', self.filename, '-o', outfile])
+        self.assertEqual(cm.exception.code, 0)
+        with open(outfile, 'rb') as fh:
+            lines = fh.read().decode('ascii').splitlines()
+        self.assertTrue(lines[0].startswith("# start user mode rounds"))
+        self.assertTrue("mean-cps" in lines[0])
+        self.assertEqual(lines[1].split()[:2], ["2011-10-24", "foo"])
+
+    def test_ghost(self):
+        history = speedpad.StatsHistory.open(self.filename, user="foo",
+                                             mode="default")
+        self.assertEqual(history.ghost("abc"), None)
+        slow = speedpad.Recording([(0.0, 1), (2.0, 2)])
+        fast = speedpad.Recording([(0.0, 1), (1.0, 2)])
+        self.assertTrue(history.write_ghost("abc", slow))
+        self.assertTrue(history.write_ghost("abc", fast))
+        self.assertFalse(history.write_ghost("abc", slow))
+        self.assertEqual(list(history.ghost("abc")), list(fast))
+        self.assertEqual(history.ghost("def"), None)
+        history.close()
+        # by user and mode
+        history = speedpad.StatsHistory.open(self.filename, user="foo",
+                                             mode="strict")
+        self.assertEqual(history.ghost("abc"), None)
+        history.close()
+
+    def test_invalid(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write(b"x" * 1024)
+        self.assertRaises(speedpad.StatsJournalError,
+                          speedpad.StatsHistory.open, self.filename)
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+    def messages(self):
+        lines, self.data = self.data.splitlines(), b''
+        return [speedpad.decode_message(line) for line in lines]
+
+
+class TestRaceServer(TestCase):
+
+    def setUp(self):
+        self.server = speedpad.RaceServer(lambda: ["foo bar", "baz"])
+
+    def connect(self, name, room='lobby'):
+        conn = speedpad.RaceConnection(self.server)
+        conn.connection_made(FakeTransport())
+        conn.data_received(speedpad.encode_message(
+                {'join': room, 'name': name}))
+        return conn
+
+    def test_broadcast(self):
+        alice = self.connect("alice")
+        bob = self.connect("bob")
+        for conn in (alice, bob):
+            self.assertEqual(conn.transport.messages(), [{'id': conn.id}])
+        for conn in (alice, bob):
+            conn.data_received(b'{"next":true}\n')
+            self.assertEqual(conn.transport.messages(),
+                             [{'race': 1, 'quote': "foo bar"}])
+        # progress is coalesced into one message per tick
+        for pos in xrange(1, 8):
+            data = speedpad.encode_message({'pos': pos, 'speed': 4.5})
+            alice.data_received(data[:4])
+            alice.data_received(data[4:])
+        self.server.broadcast()
+        standings = [{'standings': 1, 'players': [[alice.id, "alice", 7, 4.5],
+                                                  [bob.id, "bob", 0, 0.0]]}]
+        for conn in (alice, bob):
+            messages = conn.transport.messages()
+            for msg in messages:
+                msg['players'].sort()
+            self.assertEqual(messages, standings)
+        self.server.broadcast()
+        self.assertEqual(bob.transport.messages(), [])
+        # clients behind on reading skip ticks
+        alice.data_received(b'{"pos":1,"speed":1}\n')
+        bob.pause_writing()
+        self.server.broadcast()
+        self.assertEqual(len(alice.transport.messages()), 1)
+        self.assertEqual(bob.transport.messages(), [])
+        # the first player to finish starts the next race
+        alice.data_received(b'{"next":true}\n')
+        self.assertEqual(alice.transport.messages(),
+                         [{'race': 2, 'quote': "baz"}])
+        bob.connection_lost(None)
+        self.server.broadcast()
+        self.assertEqual(alice.transport.messages(),
+                         [{'standings': 2,
+                           'players': [[alice.id, "alice", 0, 0.0]]}])
+        alice.data_received(b'{"next":true}\n')
+        self.assertEqual(alice.transport.messages(),
+                         [{'race': 0, 'quote': None}])
+        alice.connection_lost(None)
+        self.assertEqual(self.server.rooms, {})
+
+    def test_errors(self):
+        def quotes():
+            calls.append(None)
+            if len(calls) == 1:
+                raise speedpad.QuoteGeneratorError("broken")
+            yield "foo bar"
+        calls = []
+        self.server = speedpad.RaceServer(quotes)
+        alice = self.connect("alice")
+        alice.transport.messages()
+        alice.data_received(b'{"next":true}\n')
+        self.assertEqual(alice.transport.messages(), [{'error': "broken"}])
+        # the quotes start over after an error
+        alice.data_received(b'{"next":true}\n')
+        self.assertEqual(alice.transport.messages(),
+                         [{'race': 1, 'quote': "foo bar"}])
+        self.assertEqual(len(calls), 2)
+
+    def test_invalid(self):
+        for data in (b'{"next":true}\n', b'[]\n', b'{\n',
+                     b'{"join":"lobby","name":1}\n', b'x' * 70000):
+            conn = speedpad.RaceConnection(self.server)
+            conn.connection_made(FakeTransport())
+            conn.data_received(data)
+            self.assertTrue(conn.transport.closed)
+
+
+@unittest.skipIf(sys.version_info < (3, 4), "requires asyncio")
+class TestRace(TestCase):
+
+    def setUp(self):
+        import asyncio
+        import threading
+        self.loop = asyncio.new_event_loop()
+        self.quotes = ["foo bar"]
+        self.server = speedpad.RaceServer(lambda: self.quotes, tick=0.01)
+        self.listener = self.server.start(self.loop, '127.0.0.1', 0)
+        self.address = self.listener.sockets[0].getsockname()[:2]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.listener.close()
+        self.loop.run_until_complete(self.listener.wait_closed())
+        self.loop.close()
+
+    def wait(self, client, condition):
+        deadline = time.time() + 5.0
+        while not condition() and time.time() < deadline:
+            client.receive()
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_race(self):
+        alice = speedpad.RaceClient.connect(self.address, "lobby", "alice")
+        bob = speedpad.RaceClient.connect(self.address, "lobby", "bob")
+        try:
+            self.assertEqual(alice.next_quote(), "foo bar")
+            self.assertEqual(bob.next_quote(), "foo bar")
+            for pos in xrange(1, 8):
+                alice.progress(pos, 6.0)
+            self.wait(bob, lambda: bob.standings.get(alice.id) ==
+                                   ("alice", 7, 6.0))
+            self.wait(alice, lambda: alice.standings.get(bob.id) ==
+                                     ("bob", 0, 0.0))
+            self.assertNotIn(alice.id, alice.standings)
+            bob.close()
+            self.wait(alice, lambda: not alice.standings)
+            self.assertEqual(alice.next_quote(), None)
+        finally:
+            alice.close()
+            bob.close()
+        self.assertRaises(speedpad.RaceError, speedpad.RaceClient.connect,
+                          ('127.0.0.1', 1), "lobby", "carol")
+
+    def test_slow_quotes(self):
+        import threading
+        fetching = threading.Event()
+        release = threading.Event()
+        def quotes():
+            fetching.set()
+            release.wait(10.0)
+            yield "foo bar"
+        self.quotes = quotes()
+        alice = speedpad.RaceClient.connect(self.address, "slow", "alice")
+        bob = None
+        try:
+            alice.send({'next': True})
+            self.assertTrue(fetching.wait(5.0))
+            # the server goes on while a quote is fetched
+            bob = speedpad.RaceClient.connect(self.address, "fast", "bob")
+            self.wait(bob, lambda: bob.id is not None)
+            release.set()
+            self.wait(alice, lambda: alice.quote == "foo bar")
+        finally:
+            release.set()
+            alice.close()
+            if bob:
+                bob.close()
+
+
 class TestTimer(TestCase):
 
     def test_start(self):
@@ -570,6 +1393,342 @@ class TestTimer(TestCase):
         self.assertEqual(timer.elapsed, 0)
 
 
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.calls = []
+        self.scheduler = speedpad.Scheduler(clock=lambda: self.now)
+
+    def task(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+    def test_timeout(self):
+        self.assertEqual(self.scheduler.timeout(), None)
+        self.scheduler.register(0.5, self.task('a'))
+        self.scheduler.register(0.1, self.task('b'))
+        self.assertAlmostEqual(self.scheduler.timeout(), 0.1)
+        self.now += 0.05
+        self.assertAlmostEqual(self.scheduler.timeout(), 0.05)
+        self.now += 1.0
+        self.assertEqual(self.scheduler.timeout(), 0.0)
+        self.assertRaises(ValueError, self.scheduler.register, 0, None)
+
+    def test_run(self):
+        a, b = self.task('a'), self.task('b')
+        self.scheduler.register(0.5, a)
+        self.scheduler.register(0.1, b)
+        self.assertEqual(self.scheduler.run('x'), 0)
+        self.now += 0.1
+        self.assertEqual(self.scheduler.run('x'), 1)
+        self.assertEqual(self.calls, [('b', 'x')])
+        # due tasks run in registration order
+        self.now += 0.4
+        self.assertEqual(self.scheduler.run('y'), 2)
+        self.assertEqual(self.calls[1:], [('a', 'y'), ('b', 'y')])
+        # missed deadlines do not pile up
+        self.now += 10.0
+        self.assertEqual(self.scheduler.run(), 2)
+        self.assertEqual(self.scheduler.run(), 0)
+        self.assertAlmostEqual(self.scheduler.timeout(), 0.1)
+
+    def test_touch(self):
+        a, b = self.task('a'), self.task('b')
+        self.scheduler.register(0.5, a)
+        self.scheduler.register(0.5, b)
+        self.now += 0.25
+        self.scheduler.touch(b)
+        self.now += 0.25
+        self.scheduler.run()
+        self.assertEqual(self.calls, [('a',)])
+        self.now += 0.25
+        self.scheduler.run()
+        self.assertEqual(self.calls, [('a',), ('b',)])
+
+    def test_reset(self):
+        self.scheduler.register(0.2, self.task('a'))
+        self.now += 1.0
+        self.scheduler.reset()
+        self.assertAlmostEqual(self.scheduler.timeout(), 0.2)
+        self.assertEqual(self.scheduler.run(), 0)
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.profiler = speedpad.Profiler(clock=lambda: self.now)
+
+    def test_histogram(self):
+        histogram = speedpad.Histogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+        for seconds in (0.000001, 0.000003, 0.000003, 0.001):
+            histogram.add(seconds)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.buckets[1], 1)
+        self.assertEqual(histogram.buckets[2], 2)
+        self.assertEqual(histogram.buckets[10], 1)
+        self.assertEqual(histogram.percentile(50), 0.000004)
+        self.assertEqual(histogram.percentile(100), 0.001)
+        self.assertAlmostEqual(histogram.mean, 0.00025175)
+
+    def test_wrap(self):
+        def refresh():
+            self.now += 1.0
+        def redraw():
+            self.now += 2.0
+            refresh()
+            return 'done'
+        refresh = self.profiler.wrap('refresh', refresh)
+        redraw = self.profiler.wrap('redraw', redraw)
+        self.assertEqual(redraw(), 'done')
+        histograms = self.profiler.histograms
+        # nested time is not counted twice
+        self.assertEqual(histograms['redraw'].total, 2.0)
+        self.assertEqual(histograms['refresh'].total, 1.0)
+        lines = self.profiler.format().splitlines()
+        self.assertEqual(lines[0], speedpad.Profiler.HEADER)
+        self.assertEqual(lines[1].split()[:3], ['redraw', '1', '2000.000'])
+
+    def test_iterate(self):
+        def quotes():
+            for quote in ("foo", "bar"):
+                self.now += 0.5
+                yield quote
+        quotes = self.profiler.iterate('quotes', quotes())
+        self.assertEqual(list(quotes), ["foo", "bar"])
+        histogram = self.profiler.histograms['quotes']
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(histogram.total, 1.0)
+
+    def test_sampler(self):
+        sampler = speedpad.StackSampler()
+        sampler.sample(sys._getframe())
+        sampler.sample(sys._getframe())
+        stack, count = sampler.format().rsplit(' ', 1)
+        self.assertEqual(count, '2')
+        self.assertTrue(stack.endswith(';test_speedpad.py:test_sampler'))
+
+
+class TestInputDecoder(TestCase):
+
+    def decode(self, decoder, data):
+        keys = []
+        for ch in bytearray(data):
+            decoder.feed(ch, keys)
+        return keys
+
+    def test_utf8(self):
+        decoder = speedpad.InputDecoder(codecs.lookup('utf-8'))
+        keys = self.decode(decoder, u"a\xe9\u20ac".encode('utf-8'))
+        self.assertEqual(keys, [(0x61, b"a", u"a"),
+                                (0xc3, b"\xc3\xa9", u"\xe9"),
+                                (0xe2, b"\xe2\x82\xac", u"\u20ac")])
+        # sequences may span several reads
+        self.assertEqual(self.decode(decoder, b"\xe2\x82"), [])
+        self.assertEqual(self.decode(decoder, b"\xac"),
+                         [(0xe2, b"\xe2\x82\xac", u"\u20ac")])
+        # invalid sequences are replaced
+        keys = self.decode(decoder, b"\xc3a\xff")
+        self.assertEqual(keys, [(0xc3, b"\xc3", u"\ufffd"),
+                                (0x61, b"a", u"a"),
+                                (0xff, b"\xff", u"\ufffd")])
+        # reset drops incomplete sequences
+        self.decode(decoder, b"\xc3")
+        decoder.reset()
+        self.assertEqual(self.decode(decoder, b"a"), [(0x61, b"a", u"a")])
+
+    def test_locale(self):
+        decoder = speedpad.InputDecoder(codecs.lookup('latin-1'))
+        self.assertEqual(self.decode(decoder, b"\xe9"),
+                         [(0xe9, b"\xe9", u"\xe9")])
+        decoder = speedpad.InputDecoder(codecs.lookup('euc-jp'))
+        data = u"a\u3042".encode('euc-jp')
+        self.assertEqual(self.decode(decoder, data),
+                         [(0x61, b"a", u"a"), (0xa4, data[1:], u"\u3042")])
+        # trailing bytes of shift_jis may look like ascii
+        decoder = speedpad.InputDecoder(codecs.lookup('shift_jis'))
+        data = u"\u30bd".encode('shift_jis')
+        self.assertEqual(data[1:], b"\\")
+        self.assertEqual(self.decode(decoder, data),
+                         [(0x83, data, u"\u30bd")])
+
+
+class TestPaceModel(TestCase):
+
+    def test_update(self):
+        model = speedpad.PaceModel(10.0, margin=0.1, alpha=0.5)
+        self.assertAlmostEqual(model.target, 11.0)
+        model.update(6.0)
+        self.assertAlmostEqual(model.speed, 8.0)
+        model.update(0.0)   # ignored
+        self.assertAlmostEqual(model.speed, 8.0)
+        model.margin = -0.5
+        self.assertAlmostEqual(model.target, 4.0)
+        # typo rates per character
+        quote = speedpad.Quote(["foo", "bar"])
+        quote.stats.typocounts['o']['x'] += 1
+        model.update(8.0, quote)
+        self.assertEqual(model.typorates['o'], 0.5)
+        self.assertEqual(model.typorates['f'], 0.0)
+        quote.stats.reset()
+        model.update(8.0, quote)
+        self.assertEqual(model.typorates['o'], 0.25)
+
+    def test_schedule(self):
+        model = speedpad.PaceModel(2.0)
+        quote = speedpad.Quote(["ab", "ba"])
+        self.assertEqual(model.schedule(quote), [0.5, 1.0, 1.5, 2.0])
+        # more time on hard characters, same time in total
+        model.typorates['a'] = 0.5
+        times = model.schedule(quote)
+        self.assertEqual(len(times), 4)
+        self.assertAlmostEqual(times[-1], 2.0)
+        self.assertAlmostEqual(times[0], 2 * (times[1] - times[0]))
+        model.speed = 0.0
+        self.assertEqual(model.schedule(quote), [])
+
+
+class TestWeakSpots(TestCase):
+
+    def test_weights(self):
+        weakspots = speedpad.WeakSpots(k=2, mincount=1)
+        quote = speedpad.Quote(["the quick", "fox"])
+        quote.stats.addtypo(0, 4)
+        quote.stats.addtypo(1, 2)   # not typed yet
+        weakspots.update(quote, quote.strpos(1, 1))
+        self.assertEqual(weakspots.seen['q'], 1)
+        self.assertEqual(weakspots.seen['th'], 1)
+        self.assertEqual(weakspots.seen['f'], 1)
+        self.assertEqual(weakspots.seen['o'], 0)
+        self.assertEqual(dict(weakspots.missed), {'q': 1, ' q': 1})
+        self.assertEqual(weakspots.weights(), [('q', 0.5), (' q', 0.5)])
+        quote.stats.reset()
+        quote.stats.addtypo(0, 0)
+        weakspots.update(quote, quote.strlen)
+        self.assertEqual(weakspots.weights(),
+                         [('q', 1 / 3.0), ('t', 1 / 3.0), (' q', 1 / 3.0)])
+
+
+class TestQuoteSelector(TestCase):
+
+    def setUp(self):
+        self.records = [b"aaaa bbbb", b"xxxx yyyy", b"aaxx bbyy", b"zzzz"]
+        self.selector = speedpad.QuoteSelector(
+                len(self.records), self.records.__getitem__,
+                lambda raw: raw.decode('ascii'), poolsize=4, minlen=1)
+
+    def test_pick(self):
+        selector = self.selector
+        self.assertEqual(selector.pick([('x', 1.0)]), b"xxxx yyyy")
+        self.assertEqual(selector.pick([('x', 1.0), ('b', 0.5)]),
+                         b"aaxx bbyy")
+        # picked quotes are out of the pool for a while
+        self.assertEqual(len(selector), 2)
+        self.assertFalse(selector.postings.get('x'))
+        self.assertIn(selector.pick([('x', 1.0)]), (b"aaaa bbbb", b"zzzz"))
+        # bigrams
+        self.assertEqual(selector.pick([('yy', 1.0), ('zz', 0.1)]),
+                         b"xxxx yyyy")
+
+    def test_empty(self):
+        selector = speedpad.QuoteSelector(0, None, None)
+        self.assertEqual(selector.pick(), None)
+        # a single quote comes again and again
+        selector = speedpad.QuoteSelector(1, self.records.__getitem__,
+                                          lambda raw: raw.decode('ascii'))
+        self.assertEqual(selector.pick(), b"aaaa bbbb")
+        self.assertEqual(selector.pick([('x', 1.0)]), b"aaaa bbbb")
+
+
+class TestTypingSession(TestCase):
+
+    def setUp(self):
+        self.session = speedpad.TypingSession(
+                buffer=speedpad.InputBuffer(10, 50))
+
+    def test_buffer(self):
+        buf = self.session.buffer
+        for ch in str2ord("foo\tx"):
+            buf.putch(ch)
+        self.assertEqual(buf.getyx(), (0, 5))
+        buf.putch(curses.ascii.NL)
+        self.assertEqual(buf.getyx(), (1, 0))
+        buf.putch(curses.ascii.BS)
+        self.assertEqual(buf.getyx(), (0, 5))
+        buf.putch(curses.ascii.BS)
+        self.assertEqual(buf.line(0), b"foo\t")
+        self.assertEqual(sorted(buf.changed), [0])
+        # lines wrap, the lower right cell stays empty
+        buf.reset()
+        for pos in xrange(10 * 50):
+            buf.putch(ord('x'))
+        self.assertEqual(buf.getyx(), (9, 49))
+        self.assertEqual(buf.line(8), b"x" * 50)
+        self.assertEqual(buf.line(9), b"x" * 49)
+
+    def test_process(self):
+        quote = speedpad.Quote(["foo", "bar"])
+        self.session.feed(quote, str2ord("fox "))
+        self.assertEqual(self.session.buffer.getyx(), (1, 0))
+        self.assertEqual(self.session.pos, 3)
+        self.assertTrue(self.session.active)
+        self.assertEqual(list(quote.stats.typos), [(0, 2)])
+        self.assertEqual(self.session.marks[-1],
+                         (0, 2, 1, speedpad.TypingSession.TYPO))
+        self.session.feed(quote, [curses.ascii.BS, curses.ascii.BS])
+        self.assertEqual(self.session.buffer.getyx(), (0, 2))
+        self.assertEqual(self.session.marks[-1],
+                         (0, 2, -1, speedpad.TypingSession.CLEAR))
+        self.assertRaises(speedpad.QuoteStopSignal,
+                          self.session.feed, quote, str2ord("o bar"))
+        self.assertTrue(quote.iscorrect())
+        self.assertEqual(self.session.pos, quote.strlen)
+        self.session.reset()
+        self.assertFalse(self.session.active)
+        self.assertEqual(self.session.buffer.getyx(), (0, 0))
+
+    def test_reflow(self):
+        quote = speedpad.Quote(["foo bar", "baz qux"],
+                               [(0, 0), (0, 8)])
+        self.session.feed(quote, str2ord("foo bar bxz"))
+        self.assertEqual(self.session.buffer.getyx(), (1, 3))
+        self.session.reflow(quote, ["foo bar baz", "qux"],
+                            [(0, 0), (0, 12)])
+        buf = self.session.buffer
+        self.assertEqual(buf.getyx(), (0, 11))
+        self.assertEqual(self.session.pos, 11)
+        # the line break typed counts as the space it was
+        self.assertEqual(buf.line(0), b"foo bar bxz")
+        self.assertFalse(buf.line(1))
+        self.assertEqual(quote.stats.typos, {(0, 9): True})
+        self.assertEqual(sorted(buf.changed), [0, 1])
+        self.session.reflow(quote, ["foo", "bar", "baz", "qux"],
+                            [(0, 0), (0, 4), (0, 8), (0, 12)])
+        self.assertEqual(buf.getyx(), (2, 3))
+        self.assertEqual([buf.line(y) for y in xrange(3)],
+                         [b"foo", b"bar", b"bxz"])
+        self.assertEqual(quote.stats.typos, {(2, 1): True})
+        # the cursor waiting at a dropped space goes to the end of line
+        self.session.feed(quote, str2ord("\b\b\b\b"))
+        self.assertEqual(buf.getyx(), (1, 3))
+        self.session.reflow(quote, ["foo bar", "baz qux"],
+                            [(0, 0), (0, 8)])
+        self.assertEqual(buf.getyx(), (0, 7))
+        self.assertEqual(buf.line(0), b"foo bar")
+        self.assertFalse(buf.line(1))
+
+    def test_expansion(self):
+        quote = speedpad.Quote(["    # foo", "    # bar"])
+        self.session.indent = True
+        self.session.syntax = True
+        self.session.tabsize = 4
+        self.session.feed(quote, str2ord("\t# foo\n"))
+        self.assertEqual(self.session.buffer.getyx(), (1, 6))
+        self.assertEqual(self.session.buffer.line(1), b"    # ")
+        self.assertFalse(self.session.queue)
+
+
 class TestProgressBar(CursesTestCase):
 
     @classmethod
@@ -656,6 +1815,114 @@ class TestProgressBar(CursesTestCase):
         self.assertEqual(eol(0), 20)
 
 
+class TestSpeedBox(CursesTestCase):
+
+    def setUp(self):
+        # 3 line x 60 col box
+        self.box = speedpad.SpeedBox(1, 1, 4, 61)
+        self.players = [speedpad.Player("p%d" % n) for n in xrange(5)]
+        for player in self.players:
+            self.box.register(player, local=player.name == "p4")
+        self.box.load(speedpad.Quote(["x" * 100]))
+
+    def names(self):
+        return [player.name for rank, player in self.box.visible()]
+
+    def move(self, player, pos, speed):
+        player.pos = pos
+        player.speed = speedpad.Speed(speed)
+        self.box.update(player)
+
+    def test_ranking(self):
+        # ties keep the order of registration
+        self.assertEqual(self.names(), ["p0", "p1", "p4"])
+        self.move(self.players[3], 10, 2.0)
+        self.move(self.players[2], 20, 2.0)
+        self.move(self.players[0], 50, 1.0)
+        self.assertEqual(self.names(), ["p2", "p3", "p4"])
+        self.assertEqual(self.box.visible()[-1], (4, self.players[4]))
+        self.move(self.players[4], 5, 3.0)
+        self.assertEqual(self.names(), ["p4", "p2", "p3"])
+        self.box.unregister(self.players[2])
+        self.assertEqual(self.names(), ["p4", "p3", "p0"])
+        self.box.reset()
+        self.assertEqual(self.names(), ["p0", "p1", "p4"])
+
+    def test_draw(self):
+        row = lambda ypos: self.box.box.instr(ypos, 0, 21).rstrip()
+        self.box.draw(speedpad.cps)
+        self.assertEqual(row(0), b"#1  p0          0 CPS")
+        self.assertEqual(row(2), b"#5  p4          0 CPS")
+        self.box.noutrefresh()
+        # rows of unchanged players are not redrawn
+        self.box.draw(speedpad.cps)
+        self.assertFalse(self.box.damaged)
+        self.move(self.players[1], 10, 2.0)
+        self.move(self.players[2], 1, 0.0)
+        self.box.draw(speedpad.cps)
+        self.assertTrue(self.box.damaged)
+        self.assertEqual(row(0), b"#1  p1          2 CPS")
+        self.assertEqual(row(1), b"#2  p2          0 CPS")
+        self.assertEqual(row(2), b"#5  p4          0 CPS")
+
+
+class TestQuoteBox(CursesTestCase):
+
+    def setUp(self):
+        # 5 line x 20 col box onto a virtual pad of 1000 x 500
+        self.box = speedpad.QuoteBox(1, 1, 6, 21, 1000, 500, 0, 0)
+        self.quote = speedpad.Quote(["line %d" % n for n in xrange(900)])
+        self.box.load(self.quote)
+
+    def line(self, ypos):
+        oy, ox = self.box.origin
+        return self.box.pad.instr(ypos - oy, 0, 10).rstrip()
+
+    def test_window(self):
+        # only a window around the visible area is materialized
+        self.assertEqual(self.box.pad.getmaxyx(), (16, 60))
+        self.assertEqual(self.line(0), b"line 0")
+        self.box.scroll(500, 0)
+        self.box.noutrefresh()
+        self.assertTrue(self.box.inwindow(500))
+        self.assertTrue(self.box.inwindow(504))
+        self.assertFalse(self.box.inwindow(0))
+        self.assertEqual(self.line(500), b"line 500")
+        self.assertEqual(self.line(504), b"line 504")
+        # the window stays put while the visible area is inside
+        origin = self.box.origin
+        self.box.scroll(1, 0)
+        self.box.noutrefresh()
+        self.assertEqual(self.box.origin, origin)
+        # columns follow as well
+        self.box.reset()
+        self.box.load(speedpad.Quote(["x" * 100 + "y"]))
+        self.box.xpos = 90
+        self.box.noutrefresh()
+        oy, ox = self.box.origin
+        self.assertEqual(self.box.pad.instr(0, 100 - ox, 1), b"y")
+
+    def test_highlight(self):
+        attr = lambda ypos, xpos: self.box.pad.inch(
+                ypos - self.box.origin[0], xpos) & curses.A_REVERSE
+        self.box.highlight(0, 1, 2, curses.A_REVERSE)
+        self.box.highlight(800, 0, 1, curses.A_REVERSE)
+        self.assertTrue(attr(0, 1))
+        self.assertTrue(attr(0, 2))
+        self.assertFalse(attr(0, 3))
+        # highlights are kept while out of the window
+        self.box.ypos = 800
+        self.box.noutrefresh()
+        self.assertTrue(attr(800, 0))
+        self.box.ypos = 0
+        self.box.noutrefresh()
+        self.assertTrue(attr(0, 1))
+        # clear up to the end of line
+        self.box.highlight(0, 0, -1, curses.A_NORMAL)
+        self.assertFalse(attr(0, 1))
+        self.assertEqual(self.box.attrs[0], [curses.A_NORMAL] * 6)
+
+
 class TestInputBox(CursesTestCase):
 
     @classmethod
@@ -669,6 +1936,44 @@ class TestInputBox(CursesTestCase):
     def tearDown(self):
         self.box.reset()
 
+    def test_window(self):
+        box = speedpad.InputBox(1, 1, 6, 21, 1000, 500, 0, 0)
+        self.assertEqual(box.pad.getmaxyx(), (16, 60))
+        for n in xrange(100):
+            box.putch(ord('a') + n % 26)
+            box.putch(curses.ascii.NL)
+        box.putch(ord('x'))
+        # typed lines outside of the window are drawn when it follows
+        self.assertFalse(box.inwindow(100))
+        box.scroll(96, 0)
+        box.noutrefresh()
+        oy, ox = box.origin
+        self.assertEqual(box.pad.getyx(), (100 - oy, 1))
+        self.assertEqual(box.pad.instr(99 - oy, 0, 2), b"v ")
+        # cursor moves within the window carry over
+        box.pad.move(99 - oy, 1)
+        box.putch(ord('w'))
+        self.assertEqual(box.buffer.line(99), b"vw")
+        # pager stats survive a redraw of the window
+        quote = speedpad.Quote(["foo"])
+        quote.stats.keystrokes_good = 3
+        box.reset()
+        box.draw_stats(quote, speedpad.Player("test"))
+        box.materialize(0, 0)
+        self.assertEqual(box.pad.instr(0, 0, 6), b"Speed:")
+
+    def test_getch(self):
+        box = speedpad.InputBox(1, 1, 10, 50, 10, 50, 0, 0,
+                                input_encoding=codecs.lookup('utf-8'))
+        for ch in reversed(bytearray(u"a\xe9".encode('utf-8'))):
+            curses.ungetch(ch)
+        curses.ungetch(curses.KEY_LEFT)
+        self.assertEqual(box.getch(), (curses.KEY_LEFT, [curses.KEY_LEFT],
+                                       None))
+        self.assertEqual(box.getch(), (0x61, b"a", u"a"))
+        self.assertEqual(box.getch(), (0xc3, b"\xc3\xa9", u"\xe9"))
+        self.assertEqual(box.getch(), (-1, None, None))
+
     def test_putch(self):
         ex = ord('x')
         # simple putch
@@ -845,6 +2150,33 @@ class TestInputBox(CursesTestCase):
         eol = self.box.eol(0)
         self.assertEqual(eol, 50)
 
+    def test_extract(self):
+        # shadow text must match the pad contents
+        def check():
+            oldy, oldx = self.box.pad.getyx()
+            for ypos in xrange(3):
+                self.assertEqual(self.box.extract(ypos, 0, 50),
+                                 self.box.pad.instr(ypos, 0, 50))
+                self.assertEqual(self.box.extract(ypos, 48, 5),
+                                 self.box.pad.instr(ypos, 48, 5))
+            self.box.pad.move(oldy, oldx)
+        self.box.reset()
+        check()
+        self.putstr("foo  bar\n  baz")
+        check()
+        self.assertEqual(self.box.extract(0, 3, 4), b"  ba")
+        for i in xrange(6):
+            self.box.putch(curses.ascii.BS)
+            check()
+        self.box.pad.move(0, 1)
+        self.box.putch(curses.ascii.BS)
+        check()
+        self.assertEqual(self.box.extract(0, 0, 2), b"oo")
+        self.box.reset()
+        self.putstr("x" * 60)
+        check()
+        self.assertEqual(self.box.eol(1), 10)
+
     def test_continue_comment(self):
         s = "#"
         self.box.reset()
@@ -1118,6 +2450,279 @@ class TestSpeedPad(CursesTestCase):
         self.instance.robot.speed = 1.0
         self.instance.update_robot_pos(self.quote)
         self.assertEqual(self.instance.robot.pos, 5)
+        # adaptive robot follows its schedule
+        self.instance.robot.pos = 0
+        self.instance.schedule = [1, 2, 3, 4.5, 5.5, 6, 7]
+        try:
+            self.instance.update_robot_pos(self.quote)
+        finally:
+            self.instance.schedule = None
+        self.assertEqual(self.instance.robot.pos, 4)
+
+    def test_update_ghost_pos(self):
+        self.quote.stats.timer.started = 100
+        self.quote.stats.timer.stopped = 102
+        ghost = speedpad.Ghost("ghost")
+        self.instance.speedbox.register(ghost)
+        self.instance.ghost = ghost
+        try:
+            self.instance.update_ghost_pos(self.quote)
+            self.assertEqual(ghost.pos, 0)
+            ghost.load(self.quote.digest, speedpad.Recording(
+                    [(0.0, 1), (1.0, 2), (1.5, 3), (3.0, 7)]))
+            self.instance.update_ghost_pos(self.quote)
+        finally:
+            self.instance.ghost = None
+            self.instance.speedbox.unregister(ghost)
+        self.assertEqual(ghost.pos, 3)
+        self.assertEqual(ghost.speed, 1.5)
+        self.assertEqual(ghost.progressbar.cur, 3)
+
+    def test_update_racers(self):
+        class Race(object):
+            def progress(self, pos, speed):
+                self.sent = (pos, speed)
+            def receive(self):
+                pass
+        race = Race()
+        race.standings = {7: ("alice", 3, 6.0), 8: ("bob", 9, 1.0)}
+        players = list(self.instance.speedbox.players)
+        self.instance.race = race
+        try:
+            self.instance.player.pos = 2
+            self.instance.update_racers(self.quote)
+            self.assertEqual(race.sent, (2, self.instance.player.speed))
+            racers = self.instance.racers
+            self.assertEqual(sorted(racers), [7, 8])
+            self.assertEqual(racers[7].pos, 3)
+            self.assertEqual(racers[7].speed, 6.0)
+            self.assertEqual(racers[8].progressbar.pos, 1.0)
+            del race.standings[8]
+            self.instance.update_racers(self.quote)
+            self.assertEqual(sorted(racers), [7])
+            # positions in the unwrapped text, "foo bar baz" wrapped at 7
+            quote = speedpad.Quote(["foo bar", "baz"], [(0, 0), (0, 8)])
+            race.standings = {7: ("alice", 8, 6.0)}
+            self.instance.player.pos = 7
+            self.instance.update_racers(quote)
+            self.assertEqual(race.sent[0], 8)
+            self.assertEqual(racers[7].pos, 7)
+            race.standings = {7: ("alice", 99, 6.0)}
+            self.instance.update_racers(quote)
+            self.assertEqual(racers[7].pos, quote.strlen)
+            race.standings = {}
+            self.instance.update_racers(self.quote)
+        finally:
+            self.instance.race = None
+            self.instance.player.pos = 0
+        self.assertEqual(self.instance.speedbox.players, players)
+
+    def test_rewrap(self):
+        instance = self.instance
+        instance.quotegen = speedpad.QuoteGenerator(
+                lambda maxsize: [], 10, 50, wrap=0, width=8)
+        quote = instance.quotegen.make_quote("foo bar baz qux")
+        instance.session.reset()
+        instance.speedbox.load(quote)
+        instance.quotebox.load(quote)
+        instance.recording = speedpad.Recording()
+        try:
+            self.type(quote, "foo bar bz")
+            self.assertEqual(instance.session.buffer.getyx(), (1, 2))
+            self.assertEqual(quote.lines, ["foo bar", "baz qux"])
+            self.assertEqual(instance.player.pos, 9)
+            # recorded in text positions, which survive the rewrap
+            self.assertEqual(instance.recording.positions[-1], 10)
+            instance.quotegen.resize(0, 12)
+            instance.rewrap(quote)
+            self.assertEqual(quote.lines, ["foo bar baz qux"])
+            self.assertEqual(instance.session.buffer.getyx(), (0, 10))
+            self.assertEqual(instance.session.buffer.line(0), b"foo bar bz")
+            self.assertEqual(instance.player.pos, 10)
+            self.assertEqual(quote.textpos(instance.player.pos), 10)
+            good = speedpad.SpeedPad.highlight[speedpad.TypingSession.GOOD]
+            typo = speedpad.SpeedPad.highlight[speedpad.TypingSession.TYPO]
+            self.assertEqual(instance.quotebox.attrs[0][8:11],
+                             [good, typo, None])
+        finally:
+            instance.quotegen = None
+            instance.recording = None
+            instance.session.reset()
+            instance.player.pos = 0
+
+    def test_resize_rewrap(self):
+        instance = self.instance
+        ymax, xmax = stdscr.getmaxyx()
+        instance.screen = stdscr
+        instance.quotegen = speedpad.QuoteGenerator(
+                lambda maxsize: [], speedpad.SpeedPad.PAD_YMAX - 1,
+                speedpad.SpeedPad.PAD_XMAX - 1,
+                width=speedpad.SpeedPad.SCR_XMIN - 1)
+        raw = " ".join(["lorem ipsum dolor sit amet"] * 30)
+        try:
+            curses.resize_term(instance.ymax, 100)
+            instance.sync()
+            quote = instance.quotegen.make_quote(raw)
+            instance.session.reset()
+            instance.speedbox.load(quote)
+            instance.quotebox.load(quote)
+            self.type(quote, raw[:250] + "x" + raw[251:590])
+            self.assertEqual(len(quote.lines[0]), 98)
+            curses.resize_term(instance.ymax, 75)
+            instance.sync()
+            self.assertTrue(instance.wrapdirty)
+            instance.update_wrap(quote)
+            self.assertFalse(instance.wrapdirty)
+            self.assertEqual(len(quote.lines[0]), 71)
+            ypos, xpos = quote.locate(0, 590)
+            self.assertEqual(instance.session.buffer.getyx(), (ypos, xpos))
+            self.assertEqual(quote.textpos(instance.player.pos), 590)
+            # the cursor stays in view
+            quotebox = instance.quotebox
+            self.assertTrue(quotebox.ypos > 0)
+            self.assertTrue(quotebox.ypos <= ypos <
+                            quotebox.ypos + quotebox.boxlines)
+            good = speedpad.SpeedPad.highlight[speedpad.TypingSession.GOOD]
+            typo = speedpad.SpeedPad.highlight[speedpad.TypingSession.TYPO]
+            for offset, attr in ((0, good), (100, good), (249, good),
+                                 (250, typo), (251, good), (589, good),
+                                 (590, None)):
+                ypos, xpos = quote.locate(0, offset)
+                self.assertEqual(quotebox.attrs[ypos][xpos], attr)
+        finally:
+            instance.session.reset()
+            instance.player.pos = 0
+            instance.wrapdirty = False
+            curses.resize_term(instance.ymax, speedpad.SpeedPad.SCR_XMIN)
+            instance.sync()
+            curses.resize_term(ymax, xmax)
+            instance.quotegen = None
+            del instance.screen
+
+    def test_resize_wakeup(self):
+        import fcntl
+        import pty
+        import signal
+        import struct
+        import termios
+        import threading
+        instance = self.instance
+        ymax, xmax = stdscr.getmaxyx()
+        master, slave = pty.openpty()
+        fcntl.ioctl(slave, termios.TIOCSWINSZ,
+                    struct.pack('4H', instance.ymax, 90, 0, 0))
+        instance.screen = stdscr
+        instance.ttyfd = slave
+        instance.quotegen = speedpad.QuoteGenerator(
+                lambda maxsize: [], speedpad.SpeedPad.PAD_YMAX - 1,
+                speedpad.SpeedPad.PAD_XMAX - 1,
+                width=speedpad.SpeedPad.SCR_XMIN - 1)
+        raw = " ".join(["lorem ipsum dolor sit amet"] * 10)
+        try:
+            instance.initsignals()
+            quote = instance.quotegen.make_quote(raw)
+            instance.session.reset()
+            instance.speedbox.load(quote)
+            instance.quotebox.load(quote)
+            self.assertTrue(len(quote.lines[0]) <= 69)
+            # before the first key, the loop waits without timeout
+            timer = threading.Timer(0.1, os.kill,
+                                    (os.getpid(), signal.SIGWINCH))
+            started = time.time()
+            timer.start()
+            instance.wait(5)
+            timer.join()
+            self.assertTrue(time.time() - started < 2)
+            instance.update_wrap(quote)
+            self.assertTrue(69 < len(quote.lines[0]) <= 89)
+        finally:
+            signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+            if instance.wakefds is not None:
+                for fd in instance.wakefds:
+                    os.close(fd)
+            instance.wakefds = None
+            instance.dumbtty = True
+            instance.ttyfd = 0
+            os.close(master)
+            os.close(slave)
+            instance.session.reset()
+            instance.wrapdirty = False
+            curses.resize_term(instance.ymax, speedpad.SpeedPad.SCR_XMIN)
+            instance.sync()
+            curses.resize_term(ymax, xmax)
+            instance.quotegen = None
+            del instance.screen
+
+    def type(self, quote, s):
+        for ch in str2ord(s):
+            self.instance.process(quote, ch, [ch])
+            while self.instance.queue:
+                ch = self.instance.queue.popleft()
+                self.instance.process(quote, ch, [ch], keyboard=False)
+
+    def test_keylog(self):
+        self.instance.keylog = speedpad.KeystrokeLog()
+        self.instance.active = False
+        self.instance.writable = True
+        try:
+            for ch in (ord('f'), ord('x'), curses.ascii.BS, ord('o')):
+                self.instance.process(self.quote, ch, [ch])
+            self.instance.process(self.quote, ord('o'), [ord('o')],
+                                  keyboard=False)
+        finally:
+            self.instance.keylog, keylog = None, self.instance.keylog
+            self.instance.active = False
+        events = [event[1:] for event in keylog]
+        self.assertEqual(events, [
+                (0, ord('f'), ord('f'), True),
+                (1, ord('o'), ord('x'), False),
+                (1, -1, curses.ascii.BS, False),
+                (1, ord('o'), ord('o'), True),
+        ])
+
+    def test_process_keys(self):
+        def paste(s):
+            for ch in reversed(str2ord(s)):
+                curses.ungetch(ch)
+        instance = self.instance
+        instance.session.reset()
+        instance.speedbox.load(self.quote)
+        try:
+            # a burst is processed at once
+            paste("foo ")
+            self.assertTrue(instance.read())
+            self.assertEqual(len(instance.inputbox.keys), 4)
+            instance.process_keys(self.quote)
+            self.assertFalse(instance.inputbox.keys)
+            self.assertFalse(instance.queue)
+            self.assertEqual(instance.session.buffer.getyx(), (0, 4))
+            self.assertEqual(self.quote.stats.keystrokes_good, 4)
+            self.assertFalse(instance.read())
+            # pastes may be rejected
+            instance.paste = 'reject'
+            paste("barx")
+            self.assertFalse(instance.read())
+            self.assertEqual(self.quote.stats.keystrokes_good, 4)
+            # control and function keys pass and do not count
+            curses.ungetch(curses.KEY_RESIZE)
+            paste("barx\x11")
+            self.assertTrue(instance.read())
+            self.assertEqual([key[0] for key in instance.inputbox.keys],
+                             [0x11, curses.KEY_RESIZE])
+            instance.inputbox.keys.clear()
+            paste("b\x11\x04\x18")
+            self.assertTrue(instance.read())
+            self.assertEqual(len(instance.inputbox.keys), 4)
+            instance.inputbox.keys.clear()
+            # short bursts are still typed
+            paste("ba")
+            self.assertTrue(instance.read())
+            instance.process_keys(self.quote)
+            self.assertEqual(instance.session.buffer.getyx(), (0, 6))
+        finally:
+            instance.paste = 'count'
+            instance.session.reset()
+            curses.flushinp()
 
     def test_process(self):
         def process(ch, **kwargs):
@@ -1528,7 +3133,7 @@ class TestSpeedPad(CursesTestCase):
 
 
 def str2ord(s):
-    return map(ord, s)
+    return list(map(ord, s))
 
 def run_tests(**kwargs):
     module = __import__(__name__)